@@ -1,81 +1,214 @@
 import io
 import re
+import numpy as np
 import streamlit as st
-import turtle
-import tempfile
-
-def extract_data(file):
+from collections import defaultdict
+from PIL import Image, ImageDraw
+
+# One pass over the whole log: each line is either a CAN ID, a Data Bytes
+# line or a generic "key: value" measurement, optionally indented and
+# optionally prefixed by a bracketed timestamp such as "[12.3]". Groups are
+# dispatched on m.lastindex: 1 = id, 2 = db, 4 = k/v. A trailing \r is left
+# out so CRLF logs parse too.
+_MASTER = re.compile(
+    r'(?m)^[ \t]*(?:\[[^\]\n]*\][ \t]*)?'
+    r'(?:ID:[ \t]*(?P<id>0x[0-9A-Fa-f]+)[^\r\n]*'
+    r'|Data Bytes:[ \t]*(?P<db>[^\r\n]*)'
+    r'|(?P<k>\w+):[ \t]*(?P<v>[^\r\n]*))\r?$'
+)
+_UNIT_RE = re.compile(r'(A|rpm|deg|Nm)\s*$')
+
+# Fields holding raw frame payloads rather than plottable measurements
+_RAW_FIELDS = frozenset({'Data Bytes', 'Data Bytes Length'})
+_FRAME_WIDTH = 8
+
+def _hex_tokens(frame):
+    """Parse a frame token by token, skipping tokens that aren't a hex byte."""
+    values = []
+    for token in frame.split():
+        try:
+            value = int(token, 16)
+        except ValueError:
+            continue
+        if 0 <= value <= 0xFF:
+            values.append(value)
+    return values
+
+def _parse_data_bytes(raw_frames):
+    """Decode Data Bytes frames into a padded uint8 matrix and frame lengths.
+
+    Returns a (frames x width) uint8 array, where width is the longest frame
+    but at least 8 and shorter frames are zero-padded, plus an array of each
+    frame's byte count. Frames that aren't two-digit hex are parsed token by
+    token.
+    """
+    frames = []
+    for frame in raw_frames:
+        try:
+            frames.append(bytes.fromhex(frame))
+        except ValueError:
+            frames.append(bytes(_hex_tokens(frame)))
+    lengths = np.array([len(frame) for frame in frames])
+    width = max(_FRAME_WIDTH, *lengths)
+    padded = b''.join(frame.ljust(width, b'\x00') for frame in frames)
+    return np.frombuffer(padded, dtype=np.uint8).reshape(len(frames), width), lengths
+
+def _convert_values(raw_values):
+    """Convert a measurement's raw strings to a float64 array in one batch.
+
+    Falls back to per-value conversion in an object array, keeping strings
+    that aren't numeric. The array dtype tells callers which path was taken.
+    """
+    try:
+        # Plain numbers go straight to NumPy's float parser
+        return np.asarray(raw_values, dtype=np.float64)
+    except ValueError:
+        pass
+    stripped = [_UNIT_RE.sub('', value) for value in raw_values]
+    try:
+        return np.asarray(stripped, dtype=np.float64)
+    except ValueError:
+        values = []
+        for raw, value in zip(raw_values, stripped):
+            try:
+                values.append(float(value))
+            except ValueError:
+                values.append(raw)  # Keep the original string if it's not a number
+        return np.array(values, dtype=object)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def extract_data(file_bytes: bytes):
     data = defaultdict(lambda: defaultdict(list))
     try:
-        buffer = io.StringIO(file.read().decode('utf-8'))
-        lines = buffer.readlines()
-
-        can_id_pattern = re.compile(r'ID:\s*(0x[0-9A-Fa-f]+)')
-        data_bytes_pattern = re.compile(r'Data Bytes:\s*(.*)')
-        measurement_pattern = re.compile(r'(\w+):\s*(.*)')
+        text = file_bytes.decode('utf-8', 'replace')
 
         current_id = None
-        for line in lines:
-            id_match = can_id_pattern.search(line)
-            if id_match:
-                current_id = id_match.group(1)
-                continue
-
-            bytes_match = data_bytes_pattern.search(line)
-            if bytes_match and current_id:
-                data_bytes = bytes_match.group(1)
-                values = [int(b, 16) for b in data_bytes.split()]
-                data[current_id]['Data Bytes'].append(values)
+        for m in _MASTER.finditer(text):
+            group = m.lastindex
+            if group == 1:
+                current_id = m.group(1)
+            elif current_id is None:
                 continue
-
-            measurement_match = measurement_pattern.search(line)
-            if measurement_match and current_id:
-                key, value = measurement_match.groups()
-                try:
-                    # Convert value to float if possible
-                    value = float(value.replace('A', '').replace('rpm', '').replace('deg', '').replace('Nm', ''))
-                except ValueError:
-                    pass  # Keep the original string if it's not a number
+            elif group == 2:
+                data[current_id]['Data Bytes'].append(m.group(2))
+            else:
+                key, value = m.group(3, 4)
                 data[current_id][key].append(value)
 
+        # Convert each measurement in one batch rather than value by value,
+        # into plain dicts so st.cache_data doesn't have to pickle the
+        # defaultdict factory
+        parsed = {}
+        for can_id, fields in data.items():
+            converted = parsed[can_id] = {}
+            for key, raw_values in fields.items():
+                if key == 'Data Bytes':
+                    converted['Data Bytes'], converted['Data Bytes Length'] = _parse_data_bytes(raw_values)
+                else:
+                    converted[key] = _convert_values(raw_values)
+
     except Exception as e:
         st.error(f"Error reading the file: {e}")
-    return data
+        # Never hand back (or cache) a partially converted result
+        return {}
+    return parsed
+
+# Traces longer than this are downsampled before drawing
+_MAX_POINTS = 2000
+
+def _lttb(values, threshold):
+    """Indices of a Largest-Triangle-Three-Buckets downsample of values."""
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # threshold - 2 buckets between the first and last point, which are always kept
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    indices = np.empty(threshold, dtype=np.intp)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = (end + next_end - 1) / 2
+        avg_y = values[end:next_end].mean()
+        xs = np.arange(start, end)
+        areas = np.abs((a - avg_x) * (values[start:end] - values[a]) - (a - xs) * (avg_y - values[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+_PLOT_SIZE = (800, 600)
+_PLOT_MARGIN = 50
+
+def _render_plot(image, xs, values):
+    """Draw values against xs onto image, scaled to fit, and return it as PNG bytes."""
+    width, height = image.size
+    left, top = _PLOT_MARGIN, _PLOT_MARGIN
+    right, bottom = width - _PLOT_MARGIN, height - _PLOT_MARGIN
+
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, height), fill='white')
+    draw.rectangle((left, top, right, bottom), outline='black')
+
+    finite = np.isfinite(values)
+    xs, values = xs[finite], values[finite]
+    if len(values):
+        x_min, x_max = xs[0], xs[-1]
+        y_min, y_max = values.min(), values.max()
+        px = left + (xs - x_min) / max(x_max - x_min, 1) * (right - left)
+        py = bottom - (values - y_min) / ((y_max - y_min) or 1) * (bottom - top)
+        draw.line(list(zip(px.tolist(), py.tolist())), fill='royalblue', width=2)
+
+        draw.text((5, top), f'{y_max:.4g}', fill='black')
+        draw.text((5, bottom - 10), f'{y_min:.4g}', fill='black')
+        draw.text((left, bottom + 5), f'{x_min}', fill='black')
+        draw.text((right - 40, bottom + 5), f'{x_max}', fill='black')
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
 
 def plot_data(selected_id, selected_measurements, data):
-    for index, measurement in enumerate(selected_measurements):
-        values = data[selected_id][measurement]
-        if values:
-            # Create a temporary file for saving the turtle graphics
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.gif') as temp_file:
-                file_path = temp_file.name
-
-                # Setup turtle graphics
-                turtle_screen = turtle.Screen()
-                turtle_screen.setup(width=800, height=600)
-                turtle_screen.title(f'{selected_id} - {measurement}')
+    # Rendered plots for the current upload, keyed by (CAN ID, measurement)
+    figs = st.session_state.setdefault('_figs', {})
+    # One canvas is reused for every measurement that needs rendering
+    image = None
 
-                turtle_pen = turtle.Turtle()
-                turtle_pen.speed(0)
-                turtle_pen.hideturtle()
-
-                turtle_pen.penup()
-                turtle_pen.goto(-300, 0)
-                turtle_pen.pendown()
-
-                # Draw the plot
-                for i, value in enumerate(values):
-                    turtle_pen.goto(-300 + (i * 10), value)
-
-                turtle_screen.update()
-
-                # Save the drawing
-                turtle_screen.getcanvas().postscript(file=file_path)
-                turtle_screen.bye()
-
-                # Show the image
-                with open(file_path, 'rb') as img_file:
-                    st.image(img_file.read(), caption=f'{selected_id} - {measurement}', use_column_width=True)
+    for measurement in selected_measurements:
+        values = data[selected_id][measurement]
+        if values.dtype.kind not in 'fiu':
+            st.write(f"{measurement} has non-numeric values and can't be plotted.")
+            continue
+        if len(values):
+            png = figs.get((selected_id, measurement))
+            if png is None:
+                xs = np.arange(len(values))
+                if len(values) > _MAX_POINTS:
+                    xs = _lttb(values, _MAX_POINTS)
+                    values = values[xs]
+
+                if image is None:
+                    image = Image.new('RGB', _PLOT_SIZE, 'white')
+                png = figs[(selected_id, measurement)] = _render_plot(image, xs, values)
+
+            st.image(png, caption=f'{selected_id} - {measurement}', width='stretch')
+
+@st.fragment
+def _plot_fragment(data, selected_id):
+    # Runs as a fragment so toggling a measurement only reruns the plot area
+    measurement_names_by_id = st.session_state.setdefault('_meas', {})
+    measurement_names = measurement_names_by_id.get(selected_id)
+    if measurement_names is None:
+        measurement_names = measurement_names_by_id[selected_id] = tuple(
+            key for key in data[selected_id] if key not in _RAW_FIELDS
+        )
+
+    selected_measurements = st.multiselect("Select measurements to plot", measurement_names, default=[])
+
+    if selected_measurements:
+        plot_data(selected_id, selected_measurements, data)
+    else:
+        st.write("Select measurements to plot.")
 
 def main():
     st.title('Enhanced CAN Bus Data Plotter')
@@ -84,26 +217,26 @@ def main():
     uploaded_file = st.file_uploader("Upload a CAN bus data file", type="txt")
 
     if uploaded_file is not None:
+        if st.session_state.get('_upload') != uploaded_file.file_id:
+            # New upload: drop plots and listings derived from the previous file
+            st.session_state['_upload'] = uploaded_file.file_id
+            st.session_state['_figs'] = {}
+            st.session_state['_ids'] = None
+            st.session_state['_meas'] = {}
+
         # Extract data from the file
-        data = extract_data(uploaded_file)
+        data = extract_data(uploaded_file.getvalue())
 
         if data:
-            unique_ids = list(data.keys())
+            if st.session_state.get('_ids') is None:
+                st.session_state['_ids'] = sorted(data.keys())
+            unique_ids = st.session_state['_ids']
             st.write("Unique CAN IDs:")
-            st.write(sorted(unique_ids))
+            st.write(unique_ids)
 
             selected_id = st.selectbox("Select CAN ID to plot", unique_ids)
             if selected_id:
-                measurements = data[selected_id]
-                measurement_names = [key for key in measurements.keys() if key != 'Data Bytes']
-
-                st.write("Select measurements to plot:")
-                selected_measurements = [key for key in measurement_names if st.checkbox(key, key=key)]
-
-                if selected_measurements:
-                    plot_data(selected_id, selected_measurements, data)
-                else:
-                    st.write("Select measurements to plot.")
+                _plot_fragment(data, selected_id)
         else:
             st.write("No data found or file is empty.")
 